@@ -1,143 +1,649 @@
 """This module provides utility functions for basic health metrics analysis."""
 
+import csv
 import sqlite3
-from pathlib import Path
-from typing import Optional
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Iterator, Sequence
+from enum import IntEnum
+from functools import cached_property
+from itertools import islice
+from math import isnan
+from operator import itemgetter
+from typing import Any, Optional, Union
+
+try:
+    import apsw
+
+    _HAVE_APSW = True
+except ImportError:
+    _HAVE_APSW = False
+
+_CREATE_INDEX_SQL = """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_metrics_patient_id
+    ON metrics (patient_id)
+"""
+
+_INSERT_SQL = """
+    INSERT INTO metrics (
+        patient_id, height_cm, weight_kg, waist_cm,
+        systolic_bp, diastolic_bp
+    )
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_CSV_COLUMNS = (
+    "PatientID",
+    "Height_cm",
+    "Weight_kg",
+    "Waist_cm",
+    "Systolic_BP",
+    "Diastolic_BP",
+)
+
+_METRIC_COLUMNS = (
+    "height_cm",
+    "weight_kg",
+    "waist_cm",
+    "systolic_bp",
+    "diastolic_bp",
+)
+
+
+class BMICategory(IntEnum):
+    """Standard BMI categories, in increasing order of BMI."""
+
+    UNDERWEIGHT = 0
+    NORMAL_WEIGHT = 1
+    OVERWEIGHT = 2
+    OBESITY = 3
+
+
+class BloodPressureCategory(IntEnum):
+    """Blood pressure categories, in increasing order of severity."""
+
+    NORMAL = 0
+    ELEVATED = 1
+    STAGE_1 = 2
+    STAGE_2 = 3
+
+
+class WaistToHeightCategory(IntEnum):
+    """Waist-to-Height Ratio risk categories."""
+
+    LOW_RISK = 0
+    HIGH_RISK = 1
+
+
+# Category boundaries and labels shared by the classification kernels.
+# Each label tuple is indexed by the matching category code.
+_BMI_BOUNDS = (18.5, 25.0, 30.0)
+_BMI_CATEGORIES = tuple(BMICategory)
+_BMI_LABELS = ("Underweight", "Normal weight", "Overweight", "Obesity")
+
+_SYSTOLIC_BOUNDS = (120.0, 130.0, 140.0)
+_DIASTOLIC_BOUNDS = (80.0, 90.0)
+_BP_CATEGORIES = tuple(BloodPressureCategory)
+_BP_LABELS = (
+    "Normal",
+    "Elevated",
+    "High Blood Pressure Stage 1",
+    "High Blood Pressure Stage 2",
+)
+# Category per diastolic bucket (rows) and systolic bucket (columns),
+# flattened so a reading needs a single index into the table.
+_BP_TABLE = tuple(
+    _BP_CATEGORIES[code]
+    for code in (
+        0, 1, 2, 3,
+        2, 2, 2, 2,
+        3, 3, 2, 3,
+    )
+)  # fmt: skip
+_SYSTOLIC_BUCKETS = len(_SYSTOLIC_BOUNDS) + 1
+
+_WAIST_TO_HEIGHT_BOUNDS = (0.5,)
+_WAIST_TO_HEIGHT_CATEGORIES = tuple(WaistToHeightCategory)
+_WAIST_TO_HEIGHT_LABELS = ("Low Risk", "High Risk")
+
+
+def _bucket_sql(value: str, bounds: Sequence[float], op: str) -> str:
+    """Return SQL counting the ``bounds`` that ``value`` is ``op`` to.
+
+    SQL comparisons evaluate to 0 or 1, so with ``>=`` this is the
+    ``bisect_right`` index of ``value`` into ``bounds`` and with ``>``
+    its ``bisect_left`` index. A NULL value gives NULL.
+    """
+    return " + ".join(f"({value} {op} {bound!r})" for bound in bounds)
+
+
+def _bp_code_sql() -> str:
+    """Return SQL looking up a reading's category in ``_BP_TABLE``."""
+    diastolic = _bucket_sql("diastolic_bp", _DIASTOLIC_BOUNDS, ">=")
+    systolic = _bucket_sql("systolic_bp", _SYSTOLIC_BOUNDS, ">=")
+    cases = "".join(
+        f" WHEN {index} THEN {code:d}" for index, code in enumerate(_BP_TABLE)
+    )
+    return f"CASE ({diastolic}) * {_SYSTOLIC_BUCKETS} + {systolic}{cases} END"
+
+
+# Values derived from the metrics, as (type, expression) pairs. SQLite
+# generates them, so they stay current however a row is inserted or
+# updated; dividing by a zero height gives NULL.
+_DERIVED_COLUMNS = {
+    "bmi": (
+        "REAL",
+        "weight_kg / ((height_cm / 100.0) * (height_cm / 100.0))",
+    ),
+    "bmi_code": ("INTEGER", _bucket_sql("bmi", _BMI_BOUNDS, ">=")),
+    "bp_code": ("INTEGER", _bp_code_sql()),
+    "waist_to_height_ratio": ("REAL", "waist_cm / height_cm"),
+    "waist_to_height_code": (
+        "INTEGER",
+        _bucket_sql("waist_to_height_ratio", _WAIST_TO_HEIGHT_BOUNDS, ">"),
+    ),
+}
+
+
+def _generated_column_sql(name: str, storage: str) -> str:
+    """Return the definition of a derived column as a generated column."""
+    declared_type, expression = _DERIVED_COLUMNS[name]
+    return (
+        f"{name} {declared_type} GENERATED ALWAYS AS ({expression}) {storage}"
+    )
+
+
+_CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS metrics (
+        patient_id TEXT,
+        height_cm REAL,
+        weight_kg REAL,
+        waist_cm REAL,
+        systolic_bp REAL,
+        diastolic_bp REAL,
+        {}
+    )
+""".format(
+    ",\n        ".join(
+        _generated_column_sql(name, "STORED") for name in _DERIVED_COLUMNS
+    )
+)
+
+_ROW_COLUMNS = ", ".join((*_METRIC_COLUMNS, *_DERIVED_COLUMNS))
+
+_FETCH_ROW_SQL = f"SELECT {_ROW_COLUMNS} FROM metrics WHERE patient_id = ?"
+
+_FETCH_ALL_ROWS_SQL = f"SELECT patient_id, {_ROW_COLUMNS} FROM metrics"
+
+# Tuning for the connections opened by _connect(), run as a script so it
+# stays out of their statement cache. Short-lived connections skip it.
+_CONNECTION_PRAGMAS = """
+    PRAGMA synchronous = NORMAL;
+    PRAGMA temp_store = MEMORY;
+    PRAGMA cache_size = -65536;
+    PRAGMA mmap_size = 268435456;
+"""
+
+# Statement cache size for the connections opened by _connect(). They
+# run a handful of fixed SELECTs, and the bulk load's INSERT along with
+# the few schema statements of its transaction.
+_CACHED_STATEMENTS = 16
+
+# Rows passed to each executemany() call when bulk loading.
+_CHUNK_SIZE = 10_000
+
+# Read buffer size for CSV input files.
+_CSV_BUFFER_SIZE = 1 << 20
+
+_MetricRow = tuple[str, float, float, float, float, float]
+_MetricValues = tuple[
+    Optional[float],
+    Optional[float],
+    Optional[float],
+    Optional[float],
+    Optional[float],
+]
+_DerivedValues = tuple[
+    Optional[float],
+    Optional[int],
+    Optional[int],
+    Optional[float],
+    Optional[int],
+]
+
+_NO_DERIVED_VALUES: _DerivedValues = (None, None, None, None, None)
+
+
+def _sqlite3_error(error: "apsw.Error") -> sqlite3.Error:
+    """Return the sqlite3 exception matching an apsw one.
+
+    This keeps the errors raised by ``_connect`` connections the same
+    whether or not apsw is installed.
+    """
+    error_types = (
+        (apsw.ConstraintError, sqlite3.IntegrityError),
+        (apsw.MismatchError, sqlite3.IntegrityError),
+        (apsw.TooBigError, sqlite3.DataError),
+        (apsw.InternalError, sqlite3.InternalError),
+        (apsw.NotFoundError, sqlite3.InternalError),
+        (apsw.CorruptError, sqlite3.DatabaseError),
+        (apsw.NotADBError, sqlite3.DatabaseError),
+        (apsw.FormatError, sqlite3.DatabaseError),
+        (apsw.MisuseError, sqlite3.InterfaceError),
+        (apsw.RangeError, sqlite3.InterfaceError),
+        (apsw.BindingsError, sqlite3.ProgrammingError),
+        (apsw.ConnectionClosedError, sqlite3.ProgrammingError),
+        (apsw.CursorClosedError, sqlite3.ProgrammingError),
+        (apsw.ExecutionCompleteError, sqlite3.ProgrammingError),
+        (apsw.ThreadingViolationError, sqlite3.ProgrammingError),
+    )
+    for apsw_type, sqlite3_type in error_types:
+        if isinstance(error, apsw_type):
+            return sqlite3_type(str(error))
+    return sqlite3.OperationalError(str(error))
+
+
+class _ApswCursor:
+    """Adapter translating the errors raised while stepping apsw rows."""
+
+    def __init__(self, cursor: "apsw.Cursor"):
+        """Wrap an apsw cursor returned by ``execute``."""
+        self._cursor = cursor
+
+    def __iter__(self) -> Iterator[Any]:
+        """Iterate over the remaining rows."""
+        try:
+            yield from self._cursor
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def fetchone(self) -> Any:
+        """Return the next row, or None when there are no more."""
+        try:
+            return self._cursor.fetchone()
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def fetchall(self) -> list[Any]:
+        """Return all of the remaining rows."""
+        try:
+            return self._cursor.fetchall()
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+
+class _ApswConnection:
+    """Adapter exposing an apsw connection through the sqlite3 calls used.
+
+    When apsw is installed, every connection the module opens goes
+    through this adapter, so the process only ever uses apsw's copy of
+    SQLite. apsw binds parameters and steps its cached prepared
+    statements with less per-call overhead than the stdlib module, which
+    matters for the hot metric lookups and the bulk INSERT. apsw errors
+    are re-raised as the matching ``sqlite3`` exceptions.
+    """
+
+    def __init__(self, db_path: str, cached_statements: int):
+        """Open an apsw connection to ``db_path``."""
+        try:
+            self._conn = apsw.Connection(
+                db_path, statementcachesize=cached_statements
+            )
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def executescript(self, sql_script: str) -> None:
+        """Execute a script of statements without caching them."""
+        try:
+            self._conn.execute(sql_script, can_cache=False).fetchall()
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def execute(self, sql: str, parameters: Sequence[Any] = ()) -> Any:
+        """Execute a statement and return a cursor over its rows."""
+        try:
+            return _ApswCursor(self._conn.execute(sql, parameters))
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def executemany(
+        self, sql: str, seq_of_parameters: Iterable[Sequence[Any]]
+    ) -> None:
+        """Execute a statement for each parameter set, atomically.
+
+        Inside an open transaction, such as the bulk load's, this is a
+        savepoint; otherwise it is a transaction of its own.
+        """
+        try:
+            with self._conn:
+                self._conn.executemany(sql, seq_of_parameters)
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def commit(self) -> None:
+        """Commit the transaction opened with BEGIN, if there is one."""
+        try:
+            if not self._conn.getautocommit():
+                self._conn.execute("COMMIT")
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def rollback(self) -> None:
+        """Roll back the open transaction, if there is one."""
+        try:
+            if not self._conn.getautocommit():
+                self._conn.execute("ROLLBACK")
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+    def close(self) -> None:
+        """Close the underlying apsw connection."""
+        try:
+            self._conn.close()
+        except apsw.Error as error:
+            raise _sqlite3_error(error) from error
+
+
+_Connection = Union[sqlite3.Connection, _ApswConnection]
+
+
+def _connect(db_path: str) -> _Connection:
+    """Open a tuned connection, using apsw when it is installed.
+
+    This is used for the connections that live as long as a database
+    object and for the bulk load, which runs its whole transaction,
+    schema statements included, on one such connection.
+    """
+    conn: _Connection
+    if _HAVE_APSW:
+        conn = _ApswConnection(db_path, _CACHED_STATEMENTS)
+    else:
+        conn = sqlite3.connect(db_path, cached_statements=_CACHED_STATEMENTS)
+    conn.executescript(_CONNECTION_PRAGMAS)
+    return conn
+
+
+def _connect_short_lived(db_path: str) -> _Connection:
+    """Open an uncached connection for a few one-off statements.
+
+    This uses the same SQLite library as ``_connect``: closing a file
+    opened through a second copy of SQLite in the process drops the POSIX
+    locks that connections of the first copy hold on it.
+    """
+    if _HAVE_APSW:
+        return _ApswConnection(db_path, 0)
+    return sqlite3.connect(db_path, cached_statements=0)
+
+
+def _execute_admin(db_path: str, *statements: str) -> None:
+    """Run one-shot statements on a short-lived connection.
+
+    This is for statements that cannot run inside a transaction, such as
+    changing the journal mode.
+    """
+    conn = _connect_short_lived(db_path)
+    try:
+        for statement in statements:
+            conn.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _metric_values(metric_data: dict[str, str]) -> _MetricRow:
+    """Convert a CSV record into the column values of a metrics row."""
+    return (
+        metric_data.get("PatientID", ""),
+        float(metric_data.get("Height_cm") or 0.0),
+        float(metric_data.get("Weight_kg") or 0.0),
+        float(metric_data.get("Waist_cm") or 0.0),
+        float(metric_data.get("Systolic_BP") or 0.0),
+        float(metric_data.get("Diastolic_BP") or 0.0),
+    )
+
+
+def _csv_rows(reader: Iterable[list[str]]) -> Iterator[_MetricRow]:
+    """Convert CSV records, headed by a header row, into metrics rows."""
+    records = filter(None, reader)
+    headers = next(records, [])
+    if not all(column in headers for column in _CSV_COLUMNS):
+        for values in records:
+            yield _metric_values(dict(zip(headers, values)))
+        return
+
+    # Project the needed fields by position instead of building a dict
+    # per record; only short or ragged records take the slow path.
+    project = itemgetter(*(headers.index(c) for c in _CSV_COLUMNS))
+    width = len(headers)
+    for values in records:
+        if len(values) != width:
+            yield _metric_values(dict(zip(headers, values)))
+            continue
+        patient_id, height, weight, waist, systolic, diastolic = project(
+            values
+        )
+        yield (
+            patient_id,
+            float(height or 0.0),
+            float(weight or 0.0),
+            float(waist or 0.0),
+            float(systolic or 0.0),
+            float(diastolic or 0.0),
+        )
+
+
+def _bmi_code(bmi: float) -> BMICategory:
+    """Return the category of a BMI value."""
+    return _BMI_CATEGORIES[bisect_right(_BMI_BOUNDS, bmi)]
+
+
+def _bp_code(systolic: float, diastolic: float) -> BloodPressureCategory:
+    """Return the category of a blood pressure reading."""
+    return _BP_TABLE[
+        bisect_right(_DIASTOLIC_BOUNDS, diastolic) * _SYSTOLIC_BUCKETS
+        + bisect_right(_SYSTOLIC_BOUNDS, systolic)
+    ]
+
+
+def _waist_to_height_code(ratio: float) -> WaistToHeightCategory:
+    """Return the category of a Waist-to-Height Ratio."""
+    return _WAIST_TO_HEIGHT_CATEGORIES[
+        bisect_left(_WAIST_TO_HEIGHT_BOUNDS, ratio)
+    ]
+
+
+def _known(value: Optional[float]) -> Optional[float]:
+    """Return ``value``, or None if it is NaN, which SQLite stores as NULL."""
+    return None if value is None or isnan(value) else value
+
+
+def _derived_values(
+    height_cm: Optional[float],
+    weight_kg: Optional[float],
+    waist_cm: Optional[float],
+    systolic_bp: Optional[float],
+    diastolic_bp: Optional[float],
+) -> _DerivedValues:
+    """Compute the derived values of a metrics row that has none stored.
+
+    This mirrors the generated columns: missing or NaN inputs give None,
+    and so does a zero height.
+    """
+    height_cm, weight_kg = _known(height_cm), _known(weight_kg)
+    waist_cm = _known(waist_cm)
+    systolic_bp, diastolic_bp = _known(systolic_bp), _known(diastolic_bp)
+    bmi = ratio = None
+    if height_cm:
+        if weight_kg is not None:
+            bmi = _known(weight_kg / (height_cm / 100) ** 2)
+        if waist_cm is not None:
+            ratio = _known(waist_cm / height_cm)
+    return (
+        bmi,
+        None if bmi is None else _bmi_code(bmi),
+        None
+        if systolic_bp is None or diastolic_bp is None
+        else _bp_code(systolic_bp, diastolic_bp),
+        ratio,
+        None if ratio is None else _waist_to_height_code(ratio),
+    )
 
 
 class HealthMetric:
     """Class representing a patient's health metrics."""
 
-    def __init__(self, patient_id: str, db_path: str = "health_metrics.db"):
-        """Initialize a HealthMetric instance."""
+    def __init__(
+        self,
+        patient_id: str,
+        db_path: str = "health_metrics.db",
+        conn: Optional[_Connection] = None,
+        row: Optional[_MetricValues] = None,
+        derived: Optional[_DerivedValues] = None,
+        database: Optional["HealthMetricsDatabase"] = None,
+    ):
+        """Initialize a HealthMetric instance.
+
+        If ``conn`` is given, the patient's row is read through it. If
+        ``database`` is given, it is read through the database's connection
+        instead while that is open, and the database is kept alive for as
+        long as the instance is. Otherwise the row is read through a
+        short-lived connection, so the instance holds no connection open.
+        A preloaded ``row`` of metric values skips the lookup query, along
+        with its stored ``derived`` values, which are computed if not given.
+        """
         self.patient_id = patient_id
         self._db_path = db_path
+        self._database = database
+        self._conn = conn
+        self._row = row
+        self._derived = derived
+        if row is not None and derived is None:
+            self._derived = _derived_values(*row)
 
-    @property
+    @cached_property
     def height_cm(self) -> Optional[float]:
         """Get the patient's height in centimeters."""
-        return self._fetch_metric("height_cm")
+        return self._load_row()[0]
 
-    @property
+    @cached_property
     def weight_kg(self) -> Optional[float]:
         """Get the patient's weight in kilograms."""
-        return self._fetch_metric("weight_kg")
+        return self._load_row()[1]
 
-    @property
+    @cached_property
     def waist_cm(self) -> Optional[float]:
         """Get the patient's waist circumference in centimeters."""
-        return self._fetch_metric("waist_cm")
+        return self._load_row()[2]
 
-    @property
+    @cached_property
     def systolic_bp(self) -> Optional[float]:
         """Get the patient's systolic blood pressure."""
-        return self._fetch_metric("systolic_bp")
+        return self._load_row()[3]
 
-    @property
+    @cached_property
     def diastolic_bp(self) -> Optional[float]:
         """Get the patient's diastolic blood pressure."""
-        return self._fetch_metric("diastolic_bp")
-
-    def _fetch_metric(self, column: str) -> Optional[float]:
-        """Fetch a specific metric value for the patient from the database."""
-        conn = sqlite3.connect(self._db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            f"SELECT {column} FROM metrics WHERE patient_id = ?",
-            (self.patient_id,),
-        )
-        result = cursor.fetchone()
-        conn.close()
-        return float(result[0]) if result and result[0] is not None else None
+        return self._load_row()[4]
+
+    def _load_row(self) -> _MetricValues:
+        """Fetch all of the patient's metrics in one query and memoize them."""
+        if self._row is None:
+            result = self._fetch_row()
+            # REAL columns already come back as floats, so use them as is.
+            if result is None:
+                self._row = (None, None, None, None, None)
+                self._derived = _NO_DERIVED_VALUES
+            else:
+                self._row = result[:5]
+                self._derived = result[5:]
+        return self._row
+
+    def _fetch_row(self) -> Any:
+        """Fetch the patient's stored row, or None if there is none."""
+        conn = self._conn
+        if self._database is not None:
+            # Borrow the database's connection without reopening it once
+            # the database has been closed.
+            conn = self._database._conn
+        if conn is None:
+            # The row is memoized, so a connection is only needed once.
+            own_conn = _connect_short_lived(self._db_path)
+            try:
+                return own_conn.execute(
+                    _FETCH_ROW_SQL, (self.patient_id,)
+                ).fetchone()
+            finally:
+                own_conn.close()
+        return conn.execute(_FETCH_ROW_SQL, (self.patient_id,)).fetchone()
+
+    def _load_derived(self) -> _DerivedValues:
+        """Return the patient's stored derived values, loading the row."""
+        if self._derived is None:
+            self._load_row()
+            assert self._derived is not None
+        return self._derived
 
     @classmethod
     def from_dict(
-        cls, metric_data: dict[str, str], db_path: str = "health_metrics.db"
+        cls,
+        metric_data: dict[str, str],
+        db_path: str = "health_metrics.db",
+        conn: Optional[sqlite3.Connection] = None,
     ) -> "HealthMetric":
-        """Create a HealthMetric instance from a dictionary of data."""
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        patient_id = metric_data.get("PatientID", "")
-        height_cm = float(metric_data.get("Height_cm") or 0.0)
-        weight_kg = float(metric_data.get("Weight_kg") or 0.0)
-        waist_cm = float(metric_data.get("Waist_cm") or 0.0)
-        systolic_bp = float(metric_data.get("Systolic_BP") or 0.0)
-        diastolic_bp = float(metric_data.get("Diastolic_BP") or 0.0)
-
-        cursor.execute(
-            """
-            INSERT INTO metrics (
-                patient_id, height_cm, weight_kg, waist_cm, 
-                systolic_bp, diastolic_bp
-            )
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (
-                patient_id,
-                height_cm,
-                weight_kg,
-                waist_cm,
-                systolic_bp,
-                diastolic_bp,
-            ),
-        )
-        conn.commit()
-        conn.close()
+        """Create a HealthMetric instance from a dictionary of data.
+
+        If ``conn`` is given, the row is inserted through it and the caller
+        owns the transaction; otherwise a connection is opened, committed
+        and closed for this one insert.
+        """
+        values = _metric_values(metric_data)
+        if conn is not None:
+            conn.execute(_INSERT_SQL, values)
+            return cls(patient_id=values[0], db_path=db_path, conn=conn)
 
-        return cls(patient_id=patient_id, db_path=db_path)
+        own_conn = _connect_short_lived(db_path)
+        own_conn.execute(_INSERT_SQL, values)
+        own_conn.commit()
+        own_conn.close()
+
+        return cls(patient_id=values[0], db_path=db_path)
 
     def bmi(self) -> Optional[float]:
         """Calculate the patient's Body Mass Index (BMI)."""
-        if self.height_cm is None or self.weight_kg is None:
-            return None
-        height_m = self.height_cm / 100
-        return self.weight_kg / (height_m**2)
+        return self._load_derived()[0]
+
+    def bmi_code(self) -> Optional[BMICategory]:
+        """Categorize the patient's BMI as a BMICategory code."""
+        code = self._load_derived()[1]
+        return None if code is None else _BMI_CATEGORIES[code]
 
     def bmi_category(self) -> Optional[str]:
         """Categorize the patient's BMI into standard categories."""
-        bmi_value = self.bmi()
-        if bmi_value is None:
-            return None
-        if bmi_value < 18.5:
-            return "Underweight"
-        elif bmi_value < 25:
-            return "Normal weight"
-        elif bmi_value < 30:
-            return "Overweight"
-        else:
-            return "Obesity"
+        code = self.bmi_code()
+        return None if code is None else _BMI_LABELS[code]
+
+    def blood_pressure_code(self) -> Optional[BloodPressureCategory]:
+        """Categorize the patient's blood pressure as a code."""
+        code = self._load_derived()[2]
+        return None if code is None else _BP_CATEGORIES[code]
 
     def blood_pressure_category(self) -> Optional[str]:
         """Categorize the patient's blood pressure."""
-        if self.systolic_bp is None or self.diastolic_bp is None:
-            return None
-        if self.systolic_bp < 120 and self.diastolic_bp < 80:
-            return "Normal"
-        elif 120 <= self.systolic_bp < 130 and self.diastolic_bp < 80:
-            return "Elevated"
-        elif (130 <= self.systolic_bp < 140) or (80 <= self.diastolic_bp < 90):
-            return "High Blood Pressure Stage 1"
-        elif (self.systolic_bp >= 140) or (self.diastolic_bp >= 90):
-            return "High Blood Pressure Stage 2"
-        else:
-            return "Hypertensive Crisis"
+        code = self.blood_pressure_code()
+        return None if code is None else _BP_LABELS[code]
 
     def waist_to_height_ratio(self) -> Optional[float]:
         """Calculate the patient's Waist-to-Height Ratio."""
-        if self.height_cm is None or self.waist_cm is None:
-            return None
-        return self.waist_cm / self.height_cm
+        return self._load_derived()[3]
+
+    def waist_to_height_code(self) -> Optional[WaistToHeightCategory]:
+        """Categorize the patient's Waist-to-Height Ratio as a code."""
+        code = self._load_derived()[4]
+        return None if code is None else _WAIST_TO_HEIGHT_CATEGORIES[code]
 
     def waist_to_height_category(self) -> Optional[str]:
         """Categorize the patient's Waist-to-Height Ratio."""
-        ratio = self.waist_to_height_ratio()
-        if ratio is None:
-            return None
-        if ratio <= 0.5:
-            return "Low Risk"
-        else:
-            return "High Risk"
+        code = self.waist_to_height_code()
+        return None if code is None else _WAIST_TO_HEIGHT_LABELS[code]
 
 
 class HealthMetricsDatabase:
@@ -146,69 +652,193 @@ class HealthMetricsDatabase:
     def __init__(self, db_path: str = "health_metrics.db"):
         """Initialize a HealthMetricsDatabase instance."""
         self._db_path = db_path
+        self._conn: Optional[_Connection] = None
         self._initialize_db()
 
+    def __del__(self) -> None:
+        """Close the database connection when the instance is collected."""
+        self.close()
+
+    def close(self) -> None:
+        """Close the database connection, if one is open."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _get_conn(self) -> _Connection:
+        """Return the database connection, opening it lazily."""
+        if self._conn is None:
+            self._conn = _connect(self._db_path)
+        return self._conn
+
     def get_metric(self, patient_id: str) -> Optional[HealthMetric]:
         """Retrieve a HealthMetric for a given patient ID."""
-        conn = sqlite3.connect(self._db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        conn = self._get_conn()
+        result = conn.execute(
             "SELECT patient_id FROM metrics WHERE patient_id = ?",
             (patient_id,),
-        )
-        result = cursor.fetchone()
-        conn.close()
+        ).fetchone()
         if result:
-            return HealthMetric(patient_id=result[0], db_path=self._db_path)
+            return HealthMetric(
+                patient_id=result[0], db_path=self._db_path, database=self
+            )
         return None
 
     def get_all_metrics(self) -> dict[str, HealthMetric]:
         """Retrieve all HealthMetric entries in the database."""
-        conn = sqlite3.connect(self._db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT patient_id FROM metrics")
-        metrics = {
-            row[0]: HealthMetric(patient_id=row[0], db_path=self._db_path)
-            for row in cursor.fetchall()
+        conn = self._get_conn()
+        return {
+            row[0]: HealthMetric(
+                patient_id=row[0], db_path=self._db_path, database=self
+            )
+            for row in conn.execute("SELECT patient_id FROM metrics")
         }
-        conn.close()
-        return metrics
 
-    def _initialize_db(self) -> None:
-        """Initialize the database schema."""
-        conn = sqlite3.connect(self._db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS metrics (
-                patient_id TEXT,
-                height_cm REAL,
-                weight_kg REAL,
-                waist_cm REAL,
-                systolic_bp REAL,
-                diastolic_bp REAL
+    def get_all_preloaded(self) -> dict[str, HealthMetric]:
+        """Retrieve all HealthMetric entries with their metrics preloaded."""
+        conn = self._get_conn()
+        return {
+            row[0]: HealthMetric(
+                patient_id=row[0],
+                db_path=self._db_path,
+                row=row[1:6],
+                derived=row[6:],
+                database=self,
             )
-            """
+            for row in conn.execute(_FETCH_ALL_ROWS_SQL)
+        }
+
+    def _categories_bulk(
+        self, column: str, labels: Sequence[str]
+    ) -> dict[str, Optional[str]]:
+        """Map every patient ID to the label of a derived code column."""
+        return {
+            patient_id: None if code is None else labels[code]
+            for patient_id, code in self._get_conn().execute(
+                f"SELECT patient_id, {column} FROM metrics"
+            )
+        }
+
+    def bmi_categories_bulk(self) -> dict[str, Optional[str]]:
+        """Categorize the BMI of every patient in the database."""
+        return self._categories_bulk("bmi_code", _BMI_LABELS)
+
+    def blood_pressure_categories_bulk(self) -> dict[str, Optional[str]]:
+        """Categorize the blood pressure of every patient in the database."""
+        return self._categories_bulk("bp_code", _BP_LABELS)
+
+    def waist_to_height_categories_bulk(self) -> dict[str, Optional[str]]:
+        """Categorize the Waist-to-Height Ratio of every patient."""
+        return self._categories_bulk(
+            "waist_to_height_code", _WAIST_TO_HEIGHT_LABELS
         )
+
+    def _initialize_db(self) -> None:
+        """Initialize the database schema, adding any missing columns.
+
+        Raises ``sqlite3.IntegrityError`` if an existing table holds
+        duplicate patient IDs, which the patient_id index rejects.
+        """
+        conn = _connect_short_lived(self._db_path)
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(_CREATE_TABLE_SQL)
+            # Map each column name to its "hidden" flag, which is 0 for
+            # plain columns and 2 or 3 for generated ones.
+            columns = {
+                row[1]: row[6]
+                for row in conn.execute("PRAGMA table_xinfo(metrics)")
+            }
+            # Older tables hold the derived values as plain columns,
+            # which go stale on UPDATE, so they are regenerated. SQLite
+            # can only add generated columns as VIRTUAL ones.
+            for name in _DERIVED_COLUMNS:
+                if columns.get(name) == 0:
+                    conn.execute(f"ALTER TABLE metrics DROP COLUMN {name}")
+                    del columns[name]
+            for name in _DERIVED_COLUMNS:
+                if name not in columns:
+                    conn.execute(
+                        "ALTER TABLE metrics ADD COLUMN"
+                        f" {_generated_column_sql(name, 'VIRTUAL')}"
+                    )
+            conn.execute(_CREATE_INDEX_SQL)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _load_rows(
+    db_path: str, rows: Iterable[_MetricRow]
+) -> HealthMetricsDatabase:
+    """Bulk load metrics rows into ``db_path``, replacing its metrics.
+
+    The file is reused in place rather than deleted, so connections that
+    are already open on it see the new rows, and a failed load leaves the
+    previous rows in place.
+    """
+    # The journal mode cannot change inside a transaction, so it is set
+    # first. The rest of the load is one transaction, and the index is
+    # only built once the rows are in so the inserts skip B-tree upkeep.
+    _execute_admin(db_path, "PRAGMA journal_mode = WAL")
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN")
+        conn.execute("DROP TABLE IF EXISTS metrics")
+        conn.execute(_CREATE_TABLE_SQL)
+        rows = iter(rows)
+        while chunk := list(islice(rows, _CHUNK_SIZE)):
+            conn.executemany(_INSERT_SQL, chunk)
+        conn.execute(_CREATE_INDEX_SQL)
+        conn.execute("ANALYZE")
         conn.commit()
+    finally:
+        # A no-op after the commit; otherwise this discards a failed load.
+        conn.rollback()
         conn.close()
 
+    return HealthMetricsDatabase(db_path)
+
 
 def parse_health_data(
     metric_filename: str, db_path: str = "health_metrics.db"
 ) -> HealthMetricsDatabase:
-    """Parse a CSV file into a HealthMetricsDatabase."""
-    db_file = Path(db_path)
-    if db_file.exists():
-        db_file.unlink()
+    """Parse a CSV file into a HealthMetricsDatabase.
+
+    Any metrics already stored at ``db_path`` are replaced. Raises
+    ``sqlite3.IntegrityError`` if a patient ID appears more than once,
+    leaving the previous rows in place.
+    """
+    with open(metric_filename, newline="", buffering=_CSV_BUFFER_SIZE) as file:
+        return _load_rows(db_path, _csv_rows(csv.reader(file)))
+
+
+def parse_health_data_arrow(
+    metric_filename: str, db_path: str = "health_metrics.db"
+) -> HealthMetricsDatabase:
+    """Parse a CSV file into a HealthMetricsDatabase using PyArrow.
 
-    db = HealthMetricsDatabase(db_path)
+    This requires the optional ``pyarrow`` package, whose multithreaded
+    CSV reader is considerably faster than ``parse_health_data`` on large
+    files.
+    """
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
 
-    with open(metric_filename) as file:
-        headers = file.readline().strip().split(",")
-        for line in file:
-            values = line.strip().split(",")
-            metric_data = dict(zip(headers, values))
-            HealthMetric.from_dict(metric_data, db_path)
+    column_types = {column: pa.float64() for column in _CSV_COLUMNS[1:]}
+    column_types["PatientID"] = pa.string()
+    table = pa_csv.read_csv(
+        metric_filename,
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            include_columns=list(_CSV_COLUMNS),
+            include_missing_columns=True,
+        ),
+    )
 
-    return db
+    patient_ids = table.column("PatientID").fill_null("")
+    values = [table.column(c).fill_null(0.0) for c in _CSV_COLUMNS[1:]]
+    rows = zip(
+        patient_ids.to_pylist(), *(column.to_pylist() for column in values)
+    )
+    return _load_rows(db_path, rows)
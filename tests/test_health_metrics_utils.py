@@ -4,15 +4,32 @@ import os
 import sqlite3
 from uuid import uuid4
 
-from health_metrics_utils import HealthMetricsDatabase
+import pytest
+
+import health_metrics_utils
+from health_metrics_utils import (
+    BloodPressureCategory,
+    BMICategory,
+    HealthMetric,
+    HealthMetricsDatabase,
+    WaistToHeightCategory,
+    parse_health_data,
+    parse_health_data_arrow,
+)
+
+
+def _remove_db_files(db_path: str) -> None:
+    """Remove a test database along with its WAL sidecar files."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
 
 
 def test_bmi_and_category() -> None:
     """Test bmi() and bmi_category() functions."""
     test_db = f"test_health_{uuid4()}.db"
 
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    _remove_db_files(test_db)
 
     db = HealthMetricsDatabase(test_db)
     conn = sqlite3.connect(test_db)
@@ -52,16 +69,14 @@ def test_bmi_and_category() -> None:
         assert metric is not None
         assert metric.bmi_category() == expected_category
 
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    _remove_db_files(test_db)
 
 
 def test_blood_pressure_category() -> None:
     """Test blood_pressure_category() function."""
     test_db = f"test_health_{uuid4()}.db"
 
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    _remove_db_files(test_db)
 
     db = HealthMetricsDatabase(test_db)
     conn = sqlite3.connect(test_db)
@@ -101,16 +116,34 @@ def test_blood_pressure_category() -> None:
         assert metric is not None
         assert metric.blood_pressure_category() == expected_category
 
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    _remove_db_files(test_db)
+
+
+def test_blood_pressure_category_boundaries() -> None:
+    """Test blood_pressure_category() at the category boundaries."""
+    test_cases = [
+        (119, 79, "Normal"),
+        (120, 79, "Elevated"),
+        (129, 79, "Elevated"),
+        (119, 80, "High Blood Pressure Stage 1"),
+        (130, 70, "High Blood Pressure Stage 1"),
+        (135, 95, "High Blood Pressure Stage 1"),
+        (140, 79, "High Blood Pressure Stage 2"),
+        (125, 90, "High Blood Pressure Stage 2"),
+    ]
+
+    for systolic, diastolic, expected_category in test_cases:
+        metric = HealthMetric(
+            "3100", row=(0.0, 0.0, 0.0, float(systolic), float(diastolic))
+        )
+        assert metric.blood_pressure_category() == expected_category
 
 
 def test_waist_to_height_ratio_and_category() -> None:
     """Test waist_to_height_ratio() and waist_to_height_category()."""
     test_db = f"test_health_{uuid4()}.db"
 
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    _remove_db_files(test_db)
 
     db = HealthMetricsDatabase(test_db)
     conn = sqlite3.connect(test_db)
@@ -148,5 +181,658 @@ def test_waist_to_height_ratio_and_category() -> None:
         assert metric is not None
         assert metric.waist_to_height_category() == expected_category
 
-    if os.path.exists(test_db):
-        os.remove(test_db)
+    _remove_db_files(test_db)
+
+
+def test_parse_health_data() -> None:
+    """Test parse_health_data() loads every CSV row."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Waist_cm,Systolic_BP,Diastolic_BP\n"
+            "1001,170,65,75,118,76\n"
+            "1002,160,80,90,140,90\n"
+            "1003,180,75,,125,82\n"
+            "\n"
+        )
+
+    db = parse_health_data(test_csv, test_db)
+    metrics = db.get_all_metrics()
+
+    assert sorted(metrics) == ["1001", "1002", "1003"]
+    assert metrics["1001"].bmi_category() == "Normal weight"
+    assert metrics["1002"].blood_pressure_category() == (
+        "High Blood Pressure Stage 2"
+    )
+    assert metrics["1003"].waist_cm == 0.0
+
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_parse_health_data_stores_derived_values() -> None:
+    """Test parse_health_data() stores BMI, ratio and category codes."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Waist_cm,Systolic_BP,Diastolic_BP\n"
+            "1001,200,100,120,135,85\n"
+        )
+
+    parse_health_data(test_csv, test_db)
+    conn = sqlite3.connect(test_db)
+    stored = conn.execute(
+        """
+        SELECT bmi, bmi_code, bp_code, waist_to_height_ratio,
+            waist_to_height_code
+        FROM metrics WHERE patient_id = ?
+        """,
+        ("1001",),
+    ).fetchone()
+    conn.close()
+
+    assert stored == (
+        25.0,
+        BMICategory.OVERWEIGHT,
+        BloodPressureCategory.STAGE_1,
+        0.6,
+        WaistToHeightCategory.HIGH_RISK,
+    )
+
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_parse_health_data_treats_nan_as_missing() -> None:
+    """Test parse_health_data() stores no categories for NaN metrics."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Waist_cm,Systolic_BP,Diastolic_BP\n"
+            "1001,200,nan,120,nan,85\n"
+        )
+
+    db = parse_health_data(test_csv, test_db)
+    metric = db.get_metric("1001")
+
+    assert metric is not None
+    assert metric.weight_kg is None
+    assert metric.systolic_bp is None
+    assert metric.bmi() is None
+    assert metric.bmi_category() is None
+    assert metric.blood_pressure_category() is None
+    assert metric.waist_to_height_category() == "High Risk"
+    assert db.bmi_categories_bulk() == {"1001": None}
+    assert db.blood_pressure_categories_bulk() == {"1001": None}
+
+    db.close()
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+@pytest.mark.parametrize(
+    "derived_columns",
+    [
+        "",
+        """,
+        bmi REAL,
+        bmi_code INTEGER,
+        bp_code INTEGER,
+        waist_to_height_ratio REAL,
+        waist_to_height_code INTEGER
+        """,
+    ],
+    ids=["metrics_only", "plain_derived_columns"],
+)
+def test_database_adds_derived_columns_to_existing_table(
+    derived_columns: str,
+) -> None:
+    """Test HealthMetricsDatabase() generates derived columns of old tables."""
+    test_db = f"test_health_{uuid4()}.db"
+
+    conn = sqlite3.connect(test_db)
+    conn.execute(
+        f"""
+        CREATE TABLE metrics (
+            patient_id TEXT,
+            height_cm REAL,
+            weight_kg REAL,
+            waist_cm REAL,
+            systolic_bp REAL,
+            diastolic_bp REAL{derived_columns}
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO metrics (
+            patient_id, height_cm, weight_kg, waist_cm,
+            systolic_bp, diastolic_bp
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        ("1001", 170, 65, 75, 118, 76),
+    )
+    if derived_columns:
+        # Plain derived columns holding values that went stale.
+        conn.execute("UPDATE metrics SET bmi = 10.0, bmi_code = 0")
+    conn.commit()
+    conn.close()
+
+    db = HealthMetricsDatabase(test_db)
+    metric = db.get_metric("1001")
+
+    assert metric is not None
+    assert metric.bmi_category() == "Normal weight"
+    assert db.blood_pressure_categories_bulk() == {"1001": "Normal"}
+
+    conn = sqlite3.connect(test_db)
+    conn.execute(
+        "UPDATE metrics SET weight_kg = 120 WHERE patient_id = '1001'"
+    )
+    conn.commit()
+    conn.close()
+    metric = db.get_metric("1001")
+
+    assert metric is not None
+    assert metric.bmi_category() == "Obesity"
+    assert db.bmi_categories_bulk() == {"1001": "Obesity"}
+
+    db.close()
+    _remove_db_files(test_db)
+
+
+def test_derived_values_follow_updates() -> None:
+    """Test every accessor reflects metrics updated outside the module."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Waist_cm,Systolic_BP,Diastolic_BP\n"
+            "1001,170,65,75,118,76\n"
+        )
+
+    db = parse_health_data(test_csv, test_db)
+    conn = sqlite3.connect(test_db)
+    conn.execute(
+        """
+        UPDATE metrics
+        SET weight_kg = 120, waist_cm = 100, systolic_bp = 145
+        WHERE patient_id = '1001'
+        """
+    )
+    conn.commit()
+    conn.close()
+    metric = db.get_metric("1001")
+
+    assert metric is not None
+    assert metric.weight_kg == 120.0
+    assert metric.bmi() == pytest.approx(41.52, abs=0.01)
+    assert metric.bmi_code() is BMICategory.OBESITY
+    assert metric.bmi_category() == "Obesity"
+    assert metric.blood_pressure_code() is BloodPressureCategory.STAGE_2
+    assert metric.blood_pressure_category() == "High Blood Pressure Stage 2"
+    assert metric.waist_to_height_ratio() == pytest.approx(100 / 170)
+    assert metric.waist_to_height_code() is WaistToHeightCategory.HIGH_RISK
+    assert metric.waist_to_height_category() == "High Risk"
+    assert db.bmi_categories_bulk() == {"1001": "Obesity"}
+    assert db.blood_pressure_categories_bulk() == {
+        "1001": "High Blood Pressure Stage 2"
+    }
+    assert db.waist_to_height_categories_bulk() == {"1001": "High Risk"}
+
+    preloaded = db.get_all_preloaded()["1001"]
+
+    assert preloaded.bmi_category() == "Obesity"
+
+    db.close()
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_parse_health_data_indexes_and_analyzes_after_load() -> None:
+    """Test parse_health_data() leaves an analyzed patient_id index."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write("PatientID,Height_cm,Weight_kg\n1001,170,65\n1002,160,80\n")
+
+    parse_health_data(test_csv, test_db)
+    conn = sqlite3.connect(test_db)
+    stats = conn.execute("SELECT idx, stat FROM sqlite_stat1").fetchall()
+    conn.close()
+
+    assert ("idx_metrics_patient_id", "2 1") in stats
+
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+@pytest.mark.parametrize("have_apsw", [False, True])
+def test_parse_health_data_rolls_back_failed_load(
+    monkeypatch: pytest.MonkeyPatch, have_apsw: bool
+) -> None:
+    """Test parse_health_data() discards a load that fails mid-stream."""
+    if have_apsw:
+        pytest.importorskip("apsw")
+    monkeypatch.setattr(health_metrics_utils, "_HAVE_APSW", have_apsw)
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg\n1001,170,65\n1002,tall,80\n"
+        )
+
+    with pytest.raises(ValueError):
+        parse_health_data(test_csv, test_db)
+
+    assert not os.path.exists(test_db + "-wal")
+    assert not os.path.exists(test_db + "-shm")
+
+    conn = sqlite3.connect(test_db)
+    tables = conn.execute("SELECT name FROM sqlite_master").fetchall()
+    conn.close()
+
+    assert tables == []
+
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_parse_health_data_reloads_database_in_place() -> None:
+    """Test a reload replaces the rows seen by an already open database."""
+    first_csv = f"test_health_{uuid4()}.csv"
+    second_csv = f"test_health_{uuid4()}.csv"
+    bad_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(first_csv, "w") as file:
+        file.write("PatientID,Height_cm,Weight_kg\n1,170,65\n2,160,80\n")
+    with open(second_csv, "w") as file:
+        file.write("PatientID,Height_cm,Weight_kg\n9,180,75\n")
+    with open(bad_csv, "w") as file:
+        file.write("PatientID,Height_cm,Weight_kg\n5,180,75\n5,170,65\n")
+
+    db = parse_health_data(first_csv, test_db)
+
+    assert sorted(db.get_all_metrics()) == ["1", "2"]
+
+    parse_health_data(second_csv, test_db)
+
+    assert sorted(db.get_all_metrics()) == ["9"]
+
+    with pytest.raises(sqlite3.IntegrityError):
+        parse_health_data(bad_csv, test_db)
+
+    assert sorted(db.get_all_metrics()) == ["9"]
+
+    db.close()
+    for path in (first_csv, second_csv, bad_csv):
+        os.remove(path)
+    _remove_db_files(test_db)
+
+
+def test_duplicate_patient_ids_are_rejected() -> None:
+    """Test repeated patient IDs fail both loading and opening a database."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write("PatientID,Height_cm,Weight_kg\n1001,170,65\n1001,160,80\n")
+
+    with pytest.raises(sqlite3.IntegrityError):
+        parse_health_data(test_csv, test_db)
+
+    _remove_db_files(test_db)
+    conn = sqlite3.connect(test_db)
+    conn.execute(
+        """
+        CREATE TABLE metrics (
+            patient_id TEXT,
+            height_cm REAL,
+            weight_kg REAL,
+            waist_cm REAL,
+            systolic_bp REAL,
+            diastolic_bp REAL
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?)",
+        [("1001", 170, 65, 75, 118, 76), ("1001", 160, 80, 90, 140, 90)],
+    )
+    conn.commit()
+    conn.close()
+
+    with pytest.raises(sqlite3.IntegrityError):
+        HealthMetricsDatabase(test_db)
+
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_parse_health_data_matches_columns_by_header() -> None:
+    """Test parse_health_data() handles reordered and missing columns."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "Weight_kg,PatientID,Height_cm,Systolic_BP,Diastolic_BP\n"
+            "65,1001,170,118,76\n"
+            "80,1002,160\n"
+        )
+
+    db = parse_health_data(test_csv, test_db)
+    first = db.get_metric("1001")
+    second = db.get_metric("1002")
+
+    assert first is not None
+    assert first.height_cm == 170.0
+    assert first.weight_kg == 65.0
+    assert first.waist_cm == 0.0
+    assert second is not None
+    assert second.systolic_bp == 0.0
+
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_parse_health_data_arrow_matches_parse_health_data() -> None:
+    """Test parse_health_data_arrow() loads the same rows."""
+    pytest.importorskip("pyarrow")
+    test_csv = f"test_health_{uuid4()}.csv"
+    csv_db = f"test_health_{uuid4()}.db"
+    arrow_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Systolic_BP,Diastolic_BP\n"
+            "1001,170,65,118,76\n"
+            "1002,160,,140,90\n"
+        )
+
+    parse_health_data(test_csv, csv_db)
+    parse_health_data_arrow(test_csv, arrow_db)
+
+    query = "SELECT * FROM metrics ORDER BY patient_id"
+    rows = []
+    for path in (csv_db, arrow_db):
+        conn = sqlite3.connect(path)
+        rows.append(conn.execute(query).fetchall())
+        conn.close()
+
+    assert rows[0] == rows[1]
+    assert rows[1][1][:6] == ("1002", 160.0, 0.0, 0.0, 140.0, 90.0)
+
+    os.remove(test_csv)
+    _remove_db_files(csv_db)
+    _remove_db_files(arrow_db)
+
+
+def test_from_dict_with_shared_connection() -> None:
+    """Test from_dict() leaves the transaction to the caller's connection."""
+    test_db = f"test_health_{uuid4()}.db"
+
+    db = HealthMetricsDatabase(test_db)
+    conn = sqlite3.connect(test_db)
+    metric = HealthMetric.from_dict(
+        {"PatientID": "8001", "Height_cm": "170", "Weight_kg": "65"},
+        test_db,
+        conn=conn,
+    )
+
+    assert metric.bmi_category() == "Normal weight"
+    assert db.get_metric("8001") is None
+
+    conn.commit()
+
+    assert db.get_metric("8001") is not None
+
+    conn.close()
+    _remove_db_files(test_db)
+
+
+def test_from_dict_metrics_hold_no_connection() -> None:
+    """Test standalone metrics close their connection after loading."""
+    test_db = f"test_health_{uuid4()}.db"
+
+    HealthMetricsDatabase(test_db).close()
+    metrics = [
+        HealthMetric.from_dict(
+            {
+                "PatientID": str(9000 + i),
+                "Height_cm": "170",
+                "Weight_kg": "65",
+            },
+            test_db,
+        )
+        for i in range(3)
+    ]
+
+    assert [m.bmi_category() for m in metrics] == ["Normal weight"] * 3
+    # SQLite removes the WAL file when the last connection closes.
+    assert not os.path.exists(test_db + "-wal")
+
+    _remove_db_files(test_db)
+
+
+def test_get_all_preloaded() -> None:
+    """Test get_all_preloaded() returns metrics without further queries."""
+    test_db = f"test_health_{uuid4()}.db"
+
+    db = HealthMetricsDatabase(test_db)
+    conn = sqlite3.connect(test_db)
+    conn.executemany(
+        """
+        INSERT INTO metrics (
+            patient_id, height_cm, weight_kg, waist_cm,
+            systolic_bp, diastolic_bp
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [("5001", 170, 65, 75, 118, 76), ("5002", 160, 80, 90, 145, 95)],
+    )
+    conn.commit()
+    conn.close()
+
+    metrics = db.get_all_preloaded()
+    db.close()
+
+    assert sorted(metrics) == ["5001", "5002"]
+    assert metrics["5001"].bmi_category() == "Normal weight"
+    assert metrics["5001"].waist_to_height_category() == "Low Risk"
+    assert metrics["5002"].bmi_category() == "Obesity"
+    assert metrics["5002"].blood_pressure_category() == (
+        "High Blood Pressure Stage 2"
+    )
+
+    _remove_db_files(test_db)
+
+
+def test_metrics_outlive_their_database() -> None:
+    """Test metrics still query after their database is dropped or closed."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Waist_cm,Systolic_BP,Diastolic_BP\n"
+            "1001,170,65,75,118,76\n"
+            "1002,160,80,90,140,90\n"
+        )
+
+    metric = parse_health_data(test_csv, test_db).get_metric("1001")
+
+    assert metric is not None
+    assert metric.bmi_category() == "Normal weight"
+
+    metrics = HealthMetricsDatabase(test_db).get_all_metrics()
+
+    assert metrics["1002"].blood_pressure_category() == (
+        "High Blood Pressure Stage 2"
+    )
+
+    db = HealthMetricsDatabase(test_db)
+    closed = db.get_metric("1002")
+    db.close()
+
+    assert closed is not None
+    assert closed.waist_to_height_category() == "High Risk"
+    # Reading the metric must not reopen the closed database.
+    assert db._conn is None
+
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_bulk_categories_match_per_patient_categories() -> None:
+    """Test the *_categories_bulk() methods against per-patient results."""
+    test_db = f"test_health_{uuid4()}.db"
+
+    db = HealthMetricsDatabase(test_db)
+    conn = sqlite3.connect(test_db)
+    conn.executemany(
+        """
+        INSERT INTO metrics (
+            patient_id, height_cm, weight_kg, waist_cm,
+            systolic_bp, diastolic_bp
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [
+            ("6001", 170, 65, 75, 118, 76),
+            ("6002", 160, 45, 80, 120, 79),
+            ("6003", 100, 25, 50, 130, 80),
+            ("6004", 100, 30, 90, 135, 95),
+            ("6005", 155, 90, 100, 145, 70),
+            ("6006", 180, 75, 85, 125, 90),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+    metrics = db.get_all_metrics()
+    bmi = db.bmi_categories_bulk()
+    blood_pressure = db.blood_pressure_categories_bulk()
+    waist_to_height = db.waist_to_height_categories_bulk()
+
+    for patient_id, metric in metrics.items():
+        assert bmi[patient_id] == metric.bmi_category()
+        assert blood_pressure[patient_id] == metric.blood_pressure_category()
+        assert waist_to_height[patient_id] == (
+            metric.waist_to_height_category()
+        )
+
+    _remove_db_files(test_db)
+
+
+def test_bulk_categories_skip_zero_height() -> None:
+    """Test the bulk methods return None for a patient with no height."""
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Waist_cm,Systolic_BP,Diastolic_BP\n"
+            "1001,170,65,75,118,76\n"
+            "1002,,80,90,140,90\n"
+        )
+
+    db = parse_health_data(test_csv, test_db)
+    metric = db.get_metric("1002")
+
+    assert db.bmi_categories_bulk() == {"1001": "Normal weight", "1002": None}
+    assert db.waist_to_height_categories_bulk() == {
+        "1001": "Low Risk",
+        "1002": None,
+    }
+    assert metric is not None
+    assert metric.bmi_category() is None
+    assert metric.waist_to_height_category() is None
+
+    db.close()
+    os.remove(test_csv)
+    _remove_db_files(test_db)
+
+
+def test_category_codes() -> None:
+    """Test the *_code() methods return the matching category enums."""
+    metric = HealthMetric("7001", row=(170.0, 65.0, 90.0, 135.0, 85.0))
+
+    assert metric.bmi_code() is BMICategory.NORMAL_WEIGHT
+    assert metric.blood_pressure_code() is BloodPressureCategory.STAGE_1
+    assert metric.waist_to_height_code() is WaistToHeightCategory.HIGH_RISK
+
+    missing = HealthMetric("7002", row=(None, None, None, None, None))
+
+    assert missing.bmi_code() is None
+    assert missing.blood_pressure_code() is None
+    assert missing.waist_to_height_code() is None
+
+
+def test_patient_id_lookup_uses_index() -> None:
+    """Test patient_id lookups are served by the patient_id index."""
+    test_db = f"test_health_{uuid4()}.db"
+
+    HealthMetricsDatabase(test_db)
+    conn = sqlite3.connect(test_db)
+    plan = conn.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM metrics WHERE patient_id = ?",
+        ("1001",),
+    ).fetchall()
+    conn.close()
+
+    assert any("idx_metrics_patient_id" in row[-1] for row in plan)
+
+    _remove_db_files(test_db)
+
+
+@pytest.mark.parametrize("have_apsw", [False, True])
+def test_connections_raise_sqlite3_errors(
+    monkeypatch: pytest.MonkeyPatch, have_apsw: bool
+) -> None:
+    """Test both connection backends raise the same sqlite3 errors."""
+    if have_apsw:
+        pytest.importorskip("apsw")
+    monkeypatch.setattr(health_metrics_utils, "_HAVE_APSW", have_apsw)
+    test_csv = f"test_health_{uuid4()}.csv"
+    test_db = f"test_health_{uuid4()}.db"
+
+    with open(test_csv, "w") as file:
+        file.write(
+            "PatientID,Height_cm,Weight_kg,Waist_cm,Systolic_BP,Diastolic_BP\n"
+            "1001,170,65,75,118,76\n"
+        )
+
+    db = parse_health_data(test_csv, test_db)
+    metric = db.get_metric("1001")
+
+    assert metric is not None
+    assert metric.bmi_category() == "Normal weight"
+
+    conn = health_metrics_utils._connect(test_db)
+
+    assert isinstance(conn, sqlite3.Connection) is not have_apsw
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute(health_metrics_utils._INSERT_SQL, ("1001",) + (0.0,) * 5)
+    with pytest.raises(sqlite3.OperationalError):
+        conn.execute("SELECT * FROM missing")
+
+    conn.close()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
+
+    db.close()
+    os.remove(test_csv)
+    _remove_db_files(test_db)